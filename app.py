@@ -3,6 +3,7 @@ import os
 import sys
 from importlib import import_module
 
+import waitress
 from configura import config
 from flask import Flask
 from loguru import logger
@@ -46,12 +47,20 @@ class Main:
         self.register_blueprints()
         task_manager.start()
 
-        self.app.run(
-            host=config.main["server"]["host"],
-            port=config.main["server"]["port"],
-            debug=not config.main["production"],
-            use_reloader=False,
-        )
+        if config.main["production"]:
+            waitress.serve(
+                self.app,
+                host=config.main["server"]["host"],
+                port=config.main["server"]["port"],
+                threads=config.main["server"]["threads"],
+            )
+        else:
+            self.app.run(
+                host=config.main["server"]["host"],
+                port=config.main["server"]["port"],
+                debug=True,
+                use_reloader=False,
+            )
 
         task_manager.stop()
 
@@ -6,16 +6,21 @@ from flask_restful import Api, Resource
 from library import processor_manager
 from library.api_utils import (create_query_results_response, make_response,
                                parameters_schema)
-from models.query import Query
+from models.object import Object
+from models.query import Query, QueryResult
 from schemas.query import (GetQueriesSchema, QueryObjectsSchema,
                            QueryResultsSchema)
 
 app = Blueprint("query", __name__, url_prefix="/api/query")
 api = Api(app)
 
+query_objects_schema = QueryObjectsSchema()
+get_queries_schema = GetQueriesSchema()
+query_results_schema = QueryResultsSchema()
+
 
 class QueryObjects(Resource):
-    method_decorators = {"get": [parameters_schema(schema=QueryObjectsSchema())]}
+    method_decorators = {"get": [parameters_schema(schema=query_objects_schema)]}
 
     def get(self, data: dict):
         """
@@ -36,7 +41,7 @@ class QueryObjects(Resource):
 
 
 class Queries(Resource):
-    method_decorators = {"get": [parameters_schema(schema=GetQueriesSchema())]}
+    method_decorators = {"get": [parameters_schema(schema=get_queries_schema)]}
 
     def get(self, data: dict):
         """
@@ -72,7 +77,7 @@ class Queries(Resource):
 
 
 class QueryResults(Resource):
-    method_decorators = {"get": [parameters_schema(QueryResultsSchema())]}
+    method_decorators = {"get": [parameters_schema(query_results_schema)]}
 
     def get(self, data: dict):
         """
@@ -84,10 +89,14 @@ class QueryResults(Resource):
         except pw.DoesNotExist:
             return make_response(error_code="C05")
 
-        results = query.results  # type: ignore
-        results = create_query_results_response(
-            [(x.object, x.distance) for x in results]
+        # Fetch the results together with their objects
+        rows = (
+            QueryResult.select(QueryResult, Object)
+            .join(Object)
+            .where(QueryResult.query == query)
+            .order_by(QueryResult.distance)
         )
+        results = create_query_results_response([(x.object, x.distance) for x in rows])
 
         return make_response(results=results)
 
@@ -1,14 +1,27 @@
 import json
 
 import chromadb
-from chromadb.utils import embedding_functions
 from configura import config
+from embeddings import create_embedding_function
 from peewee import Model, SqliteDatabase, TextField
 
-db = SqliteDatabase(config.main["database"]["sqlite"])
+db = SqliteDatabase(
+    config.main["database"]["sqlite"],
+    pragmas={
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -65536,
+        "temp_store": "memory",
+        "mmap_size": 268435456,
+        "foreign_keys": 1,
+    },
+)
 chroma = chromadb.PersistentClient(config.main["database"]["chromadb"])
-embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name=config.main["embeddings_model"]
+embedding_function = create_embedding_function()
+collection = chroma.get_or_create_collection(
+    "embeddings",
+    embedding_function=embedding_function,
+    metadata={f"hnsw:{key}": value for key, value in config.main["hnsw"].items()},
 )
 
 
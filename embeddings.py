@@ -0,0 +1,191 @@
+"""
+This module contains the embedding functions used by the chroma collection. The
+backend is selected with `config.main.embeddings_backend`.
+"""
+
+import bisect
+import os
+from abc import abstractmethod
+
+import torch
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from configura import config
+from loguru import logger
+from sentence_transformers import SentenceTransformer
+
+
+class BucketedEmbeddingFunction(EmbeddingFunction):
+
+    """
+    The base embedding function. Documents are grouped into token length buckets
+    before being encoded, so every batch is padded to the longest document in its
+    bucket instead of the longest document overall.
+    """
+
+    bucket_bounds = (16, 32, 64)
+
+    def __init__(self, batch_size: int) -> None:
+        self.batch_size = batch_size
+
+    @abstractmethod
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        """
+        Return the number of tokens of every text.
+        """
+
+    @abstractmethod
+    def encode(self, texts: list[str]) -> Embeddings:
+        """
+        Encode a batch of texts of a similar token length.
+        """
+
+    def __call__(self, texts: Documents) -> Embeddings:
+        texts = list(texts)
+        lengths = self.token_lengths(texts)
+
+        # Group the document indices by bucket, sorted by token length
+        buckets: dict[int, list[int]] = {}
+        for i in sorted(range(len(texts)), key=lengths.__getitem__):
+            bucket = bisect.bisect_left(self.bucket_bounds, lengths[i])
+            buckets.setdefault(bucket, []).append(i)
+
+        # Encode every bucket and scatter the results back into the original order
+        embeddings: Embeddings = [[] for _ in texts]
+        for indices in buckets.values():
+            for start in range(0, len(indices), self.batch_size):
+                batch = indices[start : start + self.batch_size]
+                encoded = self.encode([texts[i] for i in batch])
+                for i, embedding in zip(batch, encoded):
+                    embeddings[i] = embedding
+
+        return embeddings
+
+
+class SentenceTransformerEmbeddingFunction(BucketedEmbeddingFunction):
+
+    """
+    Runs the embeddings model with the `sentence-transformers` (PyTorch) backend.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int = 32,
+        half_precision: bool = False,
+        gpu: bool = False,
+    ) -> None:
+        super().__init__(batch_size)
+
+        # Use the GPU when possible, falling back to the CPU if loading fails
+        self.model = None
+        if gpu and torch.cuda.is_available():
+            try:
+                self.model = SentenceTransformer(model_name, device="cuda:0")
+            except Exception:
+                logger.exception("Loading the embeddings model on the GPU failed.")
+
+        if self.model is None:
+            self.model = SentenceTransformer(model_name, device="cpu")
+
+        # Half precision is only used on the GPU, the CPU stays in fp32
+        if half_precision and self.model.device.type == "cuda":
+            self.model.to(
+                torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            )
+
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        return [
+            len(x) for x in self.model.tokenizer(texts, truncation=True)["input_ids"]
+        ]
+
+    def encode(self, texts: list[str]) -> Embeddings:
+        embeddings = self.model.encode(
+            texts, batch_size=len(texts), convert_to_tensor=True
+        )
+        return embeddings.float().cpu().tolist()
+
+
+class ONNXEmbeddingFunction(BucketedEmbeddingFunction):
+
+    """
+    Runs the embeddings model with ONNX Runtime. The model is exported and optimized
+    (graph optimization level 2, fp16 when running on the GPU) the first time it is
+    used and saved under `config.main.database.onnx`.
+
+    Requires the `optimum[onnxruntime]` (or `optimum[onnxruntime-gpu]`) package.
+    """
+
+    def __init__(
+        self, model_name: str, batch_size: int = 32, gpu: bool = False
+    ) -> None:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTOptimizer
+        from optimum.onnxruntime.configuration import OptimizationConfig
+        from transformers import AutoTokenizer
+
+        super().__init__(batch_size)
+
+        if "/" not in model_name:
+            model_name = f"sentence-transformers/{model_name}"
+
+        path = os.path.join(
+            config.main["database"]["onnx"],
+            f"{model_name.replace('/', '--')}-{'gpu' if gpu else 'cpu'}",
+        )
+        provider = "CUDAExecutionProvider" if gpu else "CPUExecutionProvider"
+
+        # Export and optimize the model once
+        if not os.path.exists(os.path.join(path, "model_optimized.onnx")):
+            model = ORTModelForFeatureExtraction.from_pretrained(
+                model_name, export=True, provider=provider
+            )
+            optimizer = ORTOptimizer.from_pretrained(model)
+            optimizer.optimize(
+                save_dir=path,
+                optimization_config=OptimizationConfig(
+                    optimization_level=2, fp16=gpu, optimize_for_gpu=gpu
+                ),
+            )
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(path)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            path, file_name="model_optimized.onnx", provider=provider
+        )
+
+    def token_lengths(self, texts: list[str]) -> list[int]:
+        return [len(x) for x in self.tokenizer(texts, truncation=True)["input_ids"]]
+
+    def encode(self, texts: list[str]) -> Embeddings:
+        inputs = self.tokenizer(
+            texts, padding=True, truncation=True, return_tensors="pt"
+        ).to(self.model.device)
+        outputs = self.model(**inputs)
+
+        # Mean pooling followed by normalization, same as the sentence-transformer
+        hidden_state = outputs.last_hidden_state.float()
+        mask = inputs["attention_mask"].unsqueeze(-1).float()
+        embeddings = (hidden_state * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+        embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+
+        return embeddings.cpu().tolist()
+
+
+def create_embedding_function() -> BucketedEmbeddingFunction:
+    """
+    Create the embedding function for the backend set in `config.main.embeddings_backend`.
+    """
+
+    model_name = config.main["embeddings_model"]
+    batch_size = config.main["embeddings_batch_size"]
+
+    if config.main["embeddings_backend"] == "onnx":
+        return ONNXEmbeddingFunction(
+            model_name, batch_size=batch_size, gpu=config.main["gpu"]
+        )
+
+    return SentenceTransformerEmbeddingFunction(
+        model_name,
+        batch_size=batch_size,
+        half_precision=config.main["embeddings_half_precision"],
+        gpu=config.main["gpu"],
+    )
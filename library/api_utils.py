@@ -1,41 +1,37 @@
-import datetime as dt
 import functools
-import json
 from typing import Optional
 
+import orjson
 from configura import config
-from flask import request
+from flask import Response, request
 from marshmallow import Schema, ValidationError
-from models.object import Object
+from models.object import Object, ObjectDefinition
 
 from library.types import ErrorCodeType
 
 
 def create_query_results_response(results: list[tuple[Object, float]]) -> list:
+    """
+    Create the payload of a list of query results. The definitions of all the objects
+    are fetched with a single query.
+    """
+
+    definitions: dict = {x[0].id: [] for x in results}
+    for definition in ObjectDefinition.select().where(
+        ObjectDefinition.object.in_(list(definitions))
+    ):
+        definitions[definition.object_id].append(definition.to_json())  # type: ignore
+
     return [
         {
             **x[0].to_json(),
-            "definitions": [y.to_json() for y in x[0].definitions],  # type: ignore
+            "definitions": definitions[x[0].id],
             "distance": x[1],
         }
         for x in results
     ]
 
 
-def serialize_to_json(obj: Optional[dict] = None) -> Optional[dict]:
-    """
-    Serialize a dictionary into a JSON serialazble one.
-    """
-
-    def serializer(o):
-        if isinstance(o, ((dt.datetime, dt.date))):
-            return o.isoformat()
-
-        return str(o)
-
-    return json.loads(json.dumps(obj, default=serializer))
-
-
 def make_response(
     data: Optional[dict] = None,
     status_code: int = 200,
@@ -47,9 +43,9 @@ def make_response(
     error: Optional[dict] = None,
     error_code: Optional[ErrorCodeType] = None,
     error_message: Optional[str] = None,
-) -> tuple[dict, int]:
+) -> Response:
     """
-    Create a consistent API response.
+    Create a consistent API response. The response is serialized with `orjson`.
 
     Parameters
     ----------
@@ -104,14 +100,20 @@ def make_response(
         if pages is not None:
             data["pages"] = pages
 
-    return {
-        "data": serialize_to_json(data),
+    body = {
+        "data": data,
         "status_code": status_code,
         "message": message,
         "error": error,
         "error_code": error_code,
         "error_message": error_message,
-    }, status_code
+    }
+
+    return Response(
+        orjson.dumps(body, default=str),
+        status=status_code,
+        mimetype="application/json",
+    )
 
 
 def body_schema(schema: Schema):
@@ -124,6 +126,8 @@ def body_schema(schema: Schema):
         A marshmallow schema.
     """
 
+    load = schema.load
+
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
@@ -132,7 +136,7 @@ def body_schema(schema: Schema):
                 return make_response(error_code="C01")
 
             try:
-                result = schema.load(data)
+                result = load(data)
             except ValidationError as e:
                 return make_response(error_code="C02", error={"data": e.messages})
 
@@ -153,6 +157,8 @@ def parameters_schema(schema: Schema):
         A marshmallow schema.
     """
 
+    load = schema.load
+
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
@@ -161,7 +167,7 @@ def parameters_schema(schema: Schema):
                 return make_response(error_code="C03")
 
             try:
-                result = schema.load(data)
+                result = load(data)
             except ValidationError as e:
                 return make_response(error_code="C04", error={"data": e.messages})
 
@@ -1,13 +1,14 @@
+import functools
 import importlib.util
 import os
+import queue
 import time
 import traceback
+import uuid
 from typing import Optional
 
-import peewee
 from configura import config
-from database import chroma
-from database import embedding_function as chroma_embedding_function
+from database import collection, db, embedding_function
 from loguru import logger
 from models.object import Object, ObjectDefinition
 from models.query import Query, QueryResult
@@ -26,6 +27,13 @@ class ProcessorManager:
     def __init__(self, processors_directory: str) -> None:
         self.processors_directory = processors_directory
         self.processors: list[BaseProcessor] = []
+        self.collection = collection
+
+        # Bumped whenever embeddings are added, invalidates the cached searches
+        self.generation = 0
+
+        # Queries waiting to be saved by `TaskManager._save_queries`
+        self.save_queue: queue.Queue = queue.Queue(maxsize=256)
 
     def query(
         self, query: str, n_results: int = 35, max_distance: Optional[float] = None
@@ -57,12 +65,10 @@ class ProcessorManager:
 
         st = time.perf_counter()
 
-        results = []
-        collection = chroma.get_or_create_collection(
-            "embeddings", embedding_function=chroma_embedding_function
-        )
-        query_result = collection.query(query_texts=[query], n_results=n_results)
+        query_result = self.search(query, n_results, self.generation)
 
+        # Keep the results within the max distance
+        kept = []
         for ids, metadatas, distances in zip(
             query_result["ids"],
             query_result["metadatas"] or [],
@@ -72,33 +78,37 @@ class ProcessorManager:
                 if distance > max_distance:  # type: ignore
                     continue
 
-                logger.debug(f"Fetching object with ID of '{id}'.")
+                kept.append((id, metadata, distance))
 
-                try:
-                    obj = Object.get(Object.id == id)
-                    results.append((obj, distance))
-                except peewee.DoesNotExist:
-                    message = f"Object with ID of '{id}' does not exist."
+        # Fetch all the kept objects at once
+        logger.debug(f"Fetching {len(kept)} object(s).")
+        objects = {
+            str(x.id): x
+            for x in Object.select().where(
+                Object.id.in_([uuid.UUID(x[0]) for x in kept])
+            )
+        }
 
-                    utils.log_error(
-                        type="object-not-found-while-querying",
-                        title="Object not found while querying",
-                        message=message,
-                        metadata={"id": id, **metadata},
-                    )
+        results = []
+        for id, metadata, distance in kept:
+            obj = objects.get(id)
+            if obj is None:
+                message = f"Object with ID of '{id}' does not exist."
 
-                    logger.error(message)
-                    continue
+                utils.log_error(
+                    type="object-not-found-while-querying",
+                    title="Object not found while querying",
+                    message=message,
+                    metadata={"id": id, **metadata},
+                )
 
-        # Save the query data
-        saved_query = Query.create(
-            query=query,
-            n_results=n_results,
-            max_distance=max_distance,
-            returned_results=len(results),
-        )
-        for result in results:
-            QueryResult.create(query=saved_query, object=result[0], distance=result[1])
+                logger.error(message)
+                continue
+
+            results.append((obj, distance))
+
+        # Save the query data in the background
+        self.save_queue.put((query, n_results, max_distance, results))
 
         tt = time.perf_counter() - st
         logger.info(
@@ -113,57 +123,139 @@ class ProcessorManager:
 
         return results
 
-    def generate_embeddings(
-        self, object: Object, definitions: list[ObjectDefinition]
-    ) -> None:
+    @functools.lru_cache(maxsize=1024)
+    def embed_query(self, query: str) -> list[float]:
+        """
+        Return the embedding of a search query. Cached, as encoding the query is the
+        most expensive part of a search.
+        """
+
+        return embedding_function([query])[0]
+
+    @functools.lru_cache(maxsize=1024)
+    def search(self, query: str, n_results: int, generation: int) -> dict:
         """
-        Generate embeddings for the provided object and object definitions.
+        Search the collection for the closest objects to the query. Cached per
+        `generation` so the cache is invalidated once new embeddings are added.
 
         Parameters
         ----------
-        - `object` : Object
-            The object to generate embeddings for.
-        - `definitions` : list[ObjectDefinition]
-            A list of definitions associated with the object.
+        - `query` : str
+            The search query.
+        - `n_results` : int
+            The maximum number of results to return.
+        - `generation` : int
+            The current `ProcessorManager.generation`.
+
+        Returns
+        -------
+        `dict` :
+            The chroma query result. Must not be modified.
         """
 
-        logger.info(
-            f"Generating embeddings for object '{object}' and its {len(definitions)} definition(s)."
+        return self.collection.query(
+            query_embeddings=[self.embed_query(query)], n_results=n_results
         )
 
-        st = time.perf_counter()
+    def save_query(
+        self,
+        query: str,
+        n_results: int,
+        max_distance: float,
+        results: list[tuple[Object, float]],
+    ) -> Query:
+        """
+        Save a query and its results to the database.
 
-        documents = [f"File name: {object.name}", f"File path: {object.path}"]
-        for definition in definitions:
-            documents.append(str(definition.content))
+        Parameters
+        ----------
+        - `query` : str
+            The search query.
+        - `n_results` : int
+            The maximum number of results that was requested.
+        - `max_distance` : float
+            The max distance used for the query.
+        - `results` : list[tuple[Object, float]]
+            The results of the query and their distance.
 
-        text = "\n".join(documents)
+        Returns
+        -------
+        `Query` :
+            The saved query.
+        """
 
-        collection = chroma.get_or_create_collection(
-            "embeddings", embedding_function=chroma_embedding_function
-        )
-        collection.add(
-            documents=[text],
-            ids=[str(object.id)],
-            metadatas=[
+        with db.atomic():
+            saved_query = Query.create(
+                query=query,
+                n_results=n_results,
+                max_distance=max_distance,
+                returned_results=len(results),
+            )
+            QueryResult.insert_many(
+                [
+                    {"query": saved_query, "object": obj, "distance": distance}
+                    for obj, distance in results
+                ]
+            ).execute()
+
+        return saved_query
+
+    def generate_embeddings(
+        self, objects: list[tuple[Object, list[ObjectDefinition]]]
+    ) -> None:
+        """
+        Generate embeddings for a batch of objects and their object definitions. The
+        whole batch is encoded with a single call to the embedding function.
+
+        Parameters
+        ----------
+        - `objects` : list[tuple[Object, list[ObjectDefinition]]]
+            A list of objects to generate embeddings for, each paired with the
+            definitions associated with the object.
+        """
+
+        if not objects:
+            return
+
+        logger.info(f"Generating embeddings for {len(objects)} object(s).")
+
+        st = time.perf_counter()
+
+        documents = []
+        ids = []
+        metadatas = []
+        for object, definitions in objects:
+            lines = [f"File name: {object.name}", f"File path: {object.path}"]
+            for definition in definitions:
+                lines.append(str(definition.content))
+
+            documents.append("\n".join(lines))
+            ids.append(str(object.id))
+            metadatas.append(
                 {
                     "path": str(object.path),
                     "name": str(object.name),
                     "file_id": str(object.file_id),
                 }
-            ],
-        )
+            )
+
+        self.collection.add(documents=documents, ids=ids, metadatas=metadatas)
+        self.generation += 1
 
-        # Update the object in the database
-        Object.update(generated_embeddings=True).where(Object.id == object.id).execute()
+        # Update the objects in the database
+        Object.update(generated_embeddings=True).where(
+            Object.id.in_([object.id for object, _ in objects])
+        ).execute()
 
         tt = time.perf_counter() - st
-        message = f"Generated embeddings in {round(tt, 2)}s for object '{object}' with {len(definitions)} definition(s)."
+        message = (
+            f"Generated embeddings in {round(tt, 2)}s for {len(objects)} object(s)."
+        )
 
         utils.log_time_metric(
             type="generate-embeddings",
             tt=tt,
-            title=f"Generated embeddings for object '{object}'",
+            title=f"Generated embeddings for {len(objects)} object(s)",
             message=message,
         )
 
@@ -220,6 +312,79 @@ class ProcessorManager:
 
         return definitions
 
+    def prefetch(self, objects: list[Object]) -> None:
+        """
+        Let the processors start loading the objects that will be processed next, so
+        the loading overlaps with processing the current batch.
+
+        Parameters
+        ----------
+        - `objects` : list[Object]
+            The objects that will be passed to `process_batch` next.
+        """
+
+        for processor in self.processors:
+            group = [x for x in objects if x.type == processor.type]
+            if not group:
+                continue
+
+            try:
+                processor.prefetch(group)
+            except Exception:
+                logger.exception(
+                    f"Error prefetching {len(group)} object(s) for '{processor.title}'."
+                )
+
+    def process_batch(self, objects: list[Object]) -> list[ObjectDefinition]:
+        """
+        Process a batch of objects with the right processors, running every processor
+        once on all the objects of its type. If processing the batch fails, the objects
+        are processed one by one with `process` so only the failing objects are
+        marked as errored. Once processed, the objects are marked as processed.
+
+        Parameters
+        ----------
+        - `objects` : list[Object]
+            The unprocessed objects.
+
+        Returns
+        -------
+        `list[ObjectDefinition]` :
+            A list of generated object definitions.
+        """
+
+        logger.info(f"Processing {len(objects)} object(s).")
+
+        definitions = []
+        for type in {x.type for x in objects}:
+            group = [x for x in objects if x.type == type]
+            valid_processors = [x for x in self.processors if x.type == type]
+            if not valid_processors:
+                continue
+
+            try:
+                group_definitions = []
+                for processor in valid_processors:
+                    logger.debug(
+                        f"Running processor '{processor.title}' on {len(group)} object(s)."
+                    )
+                    group_definitions.extend(processor.process_batch(group))
+            except Exception:
+                logger.exception(
+                    "Error processing a batch of objects, processing them one by one."
+                )
+                for object in group:
+                    definitions.extend(self.process(object))
+                continue
+
+            Object.update(processed=True).where(
+                Object.id.in_([x.id for x in group])
+            ).execute()
+
+            definitions.extend(group_definitions)
+
+        return definitions
+
     def load_processor(self, file_name: str) -> Optional[BaseProcessor]:
         """
         Attempts to load the provided file (without an extension) as a processor.
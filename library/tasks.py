@@ -1,15 +1,17 @@
 import multiprocessing
 import os
-import random
+import queue
 import signal
 import threading
 import time
 import traceback
+import uuid
 from multiprocessing.synchronize import Event as EventClass
-from typing import Optional, Union
+from typing import Union
 
 import peewee as pw
 from configura import config
+from database import db
 from loguru import logger
 from models.object import IgnoredFile, Object, ObjectDefinition
 from PIL import Image
@@ -19,13 +21,28 @@ from library.exceptions import *
 
 
 class TaskManager:
-    def __init__(self) -> None:
+    def __init__(self, scan_batch_size: int = 5000) -> None:
         self.events: dict[int, Union[EventClass, threading.Event]] = {}
+        self.scan_batch_size = scan_batch_size
 
     def stop(self) -> None:
         for event in self.events.values():
             event.set()
 
+        # Save the queries that are still waiting in the queue
+        while True:
+            try:
+                item = processor_manager.save_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                processor_manager.save_query(*item)
+            except Exception:
+                logger.exception("Error saving query.")
+
+        utils.bulk_writer.flush()
+
         logger.info("Tasks are stopping...")
 
     def start(self) -> None:
@@ -51,6 +68,8 @@ class TaskManager:
             self._generate_embeddings_for_object,
             self._process_random_object,
             self._scan_objects,
+            self._save_queries,
+            self._flush_bulk_writer,
         ]  # Put indefinite tasks that should run in a different thread here
         for thread_id, thread_function in enumerate(threads, start=last_id + 1):
             event = threading.Event()
@@ -66,145 +85,293 @@ class TaskManager:
 
         logger.debug("Tasks started.")
 
+    def _get_random_objects(self, query: pw.Expression, limit: int) -> list[Object]:
+        """
+        Get up to `limit` random objects matching the provided query. Object IDs are
+        random UUIDs, so the objects following a random UUID in primary key order are
+        a random sample. This avoids `ORDER BY RANDOM()` which sorts the whole table.
+
+        Parameters
+        ----------
+        - `query` : pw.Expression
+            The where clause the objects must match.
+        - `limit` : int
+            The maximum number of objects to return.
+
+        Returns
+        -------
+        `list[Object]`
+        """
+
+        target = uuid.uuid4()
+        objects = list(
+            Object.select()
+            .where(query & (Object.id >= target))
+            .order_by(Object.id)
+            .limit(limit)
+        )
+
+        # Wrap around to the start of the table
+        if len(objects) < limit:
+            objects.extend(
+                Object.select()
+                .where(query & (Object.id < target))
+                .order_by(Object.id)
+                .limit(limit - len(objects))
+            )
+
+        return objects
+
     def _generate_embeddings_for_object(self, event: EventClass) -> None:
         """
         Start generating embeddings for all objects.
         """
 
-        def get_object_and_definitions() -> (
-            Optional[tuple[Object, list[ObjectDefinition]]]
+        batch_size = config.main["embeddings_batch_size"]
+
+        def get_objects_and_definitions() -> (
+            list[tuple[Object, list[ObjectDefinition]]]
         ):
             query = (
                 (Object.generated_embeddings == False)
                 & (Object.error == False)
                 & (Object.processed == True)
             )
-            count = Object.select().where(query).count()
-            if count == 0:
-                return
+            objects = self._get_random_objects(query, limit=batch_size)
 
-            object = (
-                Object.select().where(query).order_by(pw.fn.Random()).limit(1).first()
-            )
-            definitions = object.definitions
-            return object, definitions
+            # Fetch the definitions of all the objects at once
+            definitions: dict = {x.id: [] for x in objects}
+            for definition in ObjectDefinition.select().where(
+                ObjectDefinition.object.in_(list(definitions))
+            ):
+                definitions[definition.object_id].append(definition)  # type: ignore
+
+            return [(object, definitions[object.id]) for object in objects]
 
         while not event.is_set():
-            # Get a object and its definitions
-            query_result = get_object_and_definitions()
-            if query_result is None:
+            # Get a batch of objects and their definitions
+            objects = get_objects_and_definitions()
+            if not objects:
                 time.sleep(1)
                 continue
 
-            object, definitions = query_result
-            processor_manager.generate_embeddings(
-                object=object, definitions=definitions
-            )
+            processor_manager.generate_embeddings(objects)
             time.sleep(0.7)
 
     def _process_random_object(self, event: EventClass) -> None:
         """
-        Process a random unprocessed object from the database.
+        Process batches of random unprocessed objects from the database. The next batch
+        is picked and prefetched while the current batch is processed.
         """
 
         processor_manager.load_processors()
+        batch_size = config.main["processing_batch_size"]
 
-        def get_random_unprocessed_object() -> Optional[Object]:
+        def get_random_unprocessed_objects(exclude: list[Object]) -> list[Object]:
             query = (
                 (Object.processed == False)
                 & (Object.error == False)
                 & (Object.generated_embeddings == False)
             )
-            count = Object.select().where(query).count()
-            if count == 0:
-                return
+            if exclude:
+                query = query & Object.id.not_in([x.id for x in exclude])
+            return self._get_random_objects(query, limit=batch_size)
 
-            return (
-                Object.select().where(query).order_by(pw.fn.Random()).limit(1).first()
-            )
+        objects: list[Object] = []
+        while not event.is_set():
+            # Get a batch of random objects
+            if not objects:
+                objects = get_random_unprocessed_objects([])
+                if not objects:
+                    time.sleep(1)
+                    continue
+
+            # Start loading the next batch while the current one is processed
+            next_objects = get_random_unprocessed_objects(objects)
+            processor_manager.prefetch(next_objects)
+
+            processor_manager.process_batch(objects)
+            objects = next_objects
+
+    def _save_queries(self, event: EventClass) -> None:
+        """
+        Save the queries made through `processor_manager.query` to the database.
+        """
 
         while not event.is_set():
-            # Get a random object
-            object = get_random_unprocessed_object()
-            if object is None:
-                time.sleep(1)
+            try:
+                item = processor_manager.save_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            try:
+                processor_manager.save_query(*item)
+            except Exception:
+                logger.exception("Error saving query.")
+
+    def _flush_bulk_writer(self, event: EventClass) -> None:
+        """
+        Write the rows buffered by `utils.bulk_writer` to the database, so request
+        threads never have to.
+        """
+
+        while not event.is_set():
+            utils.bulk_writer.flush_due()
+            time.sleep(1)
+
+    def _save_files(self, files: list[tuple[str, os.stat_result]]) -> tuple[int, int]:
+        """
+        Save the provided files as objects. Files that are already saved or ignored are
+        skipped, and files that can't be objects are added to the ignored file list.
+
+        Parameters
+        ----------
+        - `files` : list[tuple[str, os.stat_result]]
+            A list of file paths paired with their `os.stat` result.
+
+        Returns
+        -------
+        `tuple[int, int]` :
+            The number of saved files and the number of duplicates.
+        """
+
+        files_ids = [
+            (path, stat, utils.get_file_id(path, stat)) for path, stat in files
+        ]
+
+        # Find the files that are neither saved nor ignored with a single join
+        # against a temporary table of the batch's file IDs
+        with db.atomic():
+            db.execute_sql(
+                "CREATE TEMP TABLE IF NOT EXISTS scan_ids (file_id TEXT PRIMARY KEY)"
+            )
+            db.execute_sql("DELETE FROM scan_ids")
+            db.cursor().executemany(
+                "INSERT OR IGNORE INTO scan_ids (file_id) VALUES (?)",
+                [(x[2],) for x in files_ids],
+            )
+            object_table = Object._meta.table_name  # type: ignore
+            ignored_file_table = IgnoredFile._meta.table_name  # type: ignore
+            cursor = db.execute_sql(
+                "SELECT s.file_id FROM scan_ids s "
+                f'LEFT JOIN "{object_table}" o ON o.file_id = s.file_id '
+                f'LEFT JOIN "{ignored_file_table}" i ON i.file_id = s.file_id '
+                "WHERE o.file_id IS NULL AND i.file_id IS NULL"
+            )
+            unknown = {x[0] for x in cursor.fetchall()}
+
+        files_saved = 0
+        files_duplicate = 0
+        ignored_files = []
+
+        for path, stat, file_id in files_ids:
+            if file_id not in unknown:
+                files_duplicate += 1
                 continue
 
-            processor_manager.process(object)
+            unknown.discard(file_id)
+
+            ignore = False
+            ignore_type = "invalid-file"
+            try:
+                obj = Object.from_path(path, stat)
+                if obj:
+                    files_saved += 1
+                else:
+                    ignore = True
+            except Image.DecompressionBombError:
+                logger.exception("Decompression Bomb Error.")
+                utils.log_error(
+                    type="decompression-bomb-error",
+                    title="Decompression Bomb Error",
+                    message=f"A decompression bomb error has occurred while trying to create an object from the path '{path}'.",
+                    traceback=traceback.format_exc(),
+                    metadata={"path": path},
+                )
+                ignore = True
+                ignore_type = "decompression-bomb-error"
+
+            if ignore:
+                logger.info(
+                    f"Adding '{path}' to ignored file list because of '{ignore_type}'."
+                )
+                ignored_files.append({"file_id": file_id, "type": ignore_type})
+
+        # Save the ignored files at once
+        if ignored_files:
+            with db.atomic():
+                IgnoredFile.insert_many(ignored_files).on_conflict_ignore().execute()
+
+        return files_saved, files_duplicate
 
     def _scan_objects(self, event: EventClass) -> None:
         """
         Scan the device for potential objects and save them to the database.
         """
 
+        # Gather all valid file extensions and ignored directories
+        file_extensions = frozenset(
+            (x if x.startswith(".") else f".{x}").lower()
+            for type in config.types
+            for x in type["file_extensions"]
+        )
+        ignored_directories = frozenset(config.ignored_directories)
+
         while not event.is_set():
             st = time.perf_counter()
 
             logger.info("Scanning objects to save.")
 
-            # Gather all valid file extensions
-            file_extensions = []
-            for type in config.types:
-                file_extensions.extend(type["file_extensions"])
-            file_extensions = tuple(file_extensions)
-
             files_saved = 0
             files_duplicate = 0
+            pending: list[tuple[str, os.stat_result]] = []
 
             try:
-                for drive in utils.get_drives():
-                    for root, dirs, files in os.walk(drive):
-                        if event.is_set():
-                            raise StopException
-
-                        dirs[:] = [
-                            d for d in dirs if d not in config.ignored_directories
-                        ]
-
-                        for file in files:
-                            if not file.lower().endswith(file_extensions):
-                                continue
-
-                            path = os.path.join(root, file)
-                            file_id = utils.get_file_id(path)
-                            if (
-                                not Object.select(pw.fn.COUNT(Object.id))
-                                .where(Object.file_id == file_id)
-                                .scalar()
-                            ) and (
-                                not IgnoredFile.select()
-                                .where(IgnoredFile.file_id == file_id)
-                                .count()
-                            ):
-                                ignore = False
-                                ignore_type = "invalid-file"
-                                try:
-                                    obj = Object.from_path(path)
-                                    if obj:
-                                        files_saved += 1
-                                    else:
-                                        ignore = True
-                                except Image.DecompressionBombError:
-                                    logger.exception("Decompression Bomb Error.")
-                                    utils.log_error(
-                                        type="decompression-bomb-error",
-                                        title="Decompression Bomb Error",
-                                        message=f"A decompression bomb error has occurred while trying to create an object from the path '{path}'.",
-                                        traceback=traceback.format_exc(),
-                                        metadata={"path": path},
-                                    )
-                                    ignore = True
-                                    ignore_type = "decompression-bomb-error"
-
-                                if ignore:
-                                    logger.info(
-                                        f"Adding '{path}' to ignored file list because of '{ignore_type}'."
-                                    )
-                                    IgnoredFile.create(
-                                        file_id=file_id, type=ignore_type
-                                    )
-                            else:
-                                files_duplicate += 1
+                directories = utils.get_drives()
+                while directories:
+                    if event.is_set():
+                        raise StopException
+
+                    # Read the directory in one go, skipping unreadable ones
+                    directory = directories.pop()
+                    try:
+                        with os.scandir(directory) as it:
+                            entries = list(it)
+                    except OSError:
+                        continue
+
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                        except OSError:
+                            continue
+
+                        if is_dir:
+                            if entry.name not in ignored_directories:
+                                directories.append(entry.path)
+                            continue
+
+                        name = entry.name
+                        dot = name.rfind(".")
+                        if dot < 0 or name[dot:].lower() not in file_extensions:
+                            continue
+
+                        # The file may have been removed since the directory was read
+                        try:
+                            stat = utils.stat_dir_entry(entry)
+                        except OSError:
+                            continue
+
+                        pending.append((entry.path, stat))
+                        if len(pending) >= self.scan_batch_size:
+                            saved, duplicate = self._save_files(pending)
+                            files_saved += saved
+                            files_duplicate += duplicate
+                            pending.clear()
+
+                saved, duplicate = self._save_files(pending)
+                files_saved += saved
+                files_duplicate += duplicate
 
             except StopException:
                 logger.info("Stopping objects scanner...")
@@ -1,20 +1,132 @@
+import ctypes
 import os
+import platform
 import string
-from typing import Optional
+import struct
+import threading
+import time
+from typing import Optional, TypeVar
 
+import peewee as pw
 from configura import config
+from loguru import logger
 from models.error import Error
 from models.metric import TimeMetric
 from PIL import Image
 
 from .types import ErrorLogType, ObjectType, TimeMetricType
 
+ModelType = TypeVar("ModelType", bound=pw.Model)
+
+# Maps a lowercase file extension to its object type
+_EXT_TO_TYPE: dict[str, ObjectType] = {
+    ext.lower(): type["type"]
+    for type in config.types
+    for ext in type["file_extensions"]
+}
+
+
+class BulkWriter:
+
+    """
+    Buffers new rows per model and inserts them with `insert_many` inside a single
+    transaction. Adding rows never writes to the database; the buffers are written
+    by `flush_due` from a background task once a model's buffer holds `size` rows or
+    the last flush is older than `interval` seconds, or when `flush` is called.
+    """
+
+    def __init__(self, size: int = 500, interval: float = 30) -> None:
+        self.size = size
+        self.interval = interval
+        self.buffers: dict[type[pw.Model], list[dict]] = {}
+        self.last_flush = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, instance: ModelType) -> ModelType:
+        """
+        Buffer an unsaved model instance for insertion.
+
+        Parameters
+        ----------
+        - `instance` : ModelType
+            The model instance. Field defaults are already set by the constructor.
+
+        Returns
+        -------
+        `ModelType` :
+            The provided instance.
+        """
+
+        model = type(instance)
+        fields = model._meta.fields  # type: ignore
+        row = {name: instance.__data__.get(name) for name in fields}
+
+        with self.lock:
+            self.buffers.setdefault(model, []).append(row)
+
+        return instance
+
+    def flush_due(self) -> None:
+        """
+        Flush every model whose buffer is full, or every model if the last flush is
+        older than `interval` seconds.
+        """
+
+        with self.lock:
+            stale = time.perf_counter() - self.last_flush >= self.interval
+            full = [x for x, rows in self.buffers.items() if len(rows) >= self.size]
+
+        if stale:
+            self.flush()
+        else:
+            for model in full:
+                self.flush(model)
+
+    def flush(self, model: Optional[type[pw.Model]] = None) -> None:
+        """
+        Insert the buffered rows of the provided model, or of every model if no model
+        is provided.
+        """
+
+        with self.lock:
+            models = [model] if model else list(self.buffers)
+            buffers = [(x, self.buffers.pop(x, [])) for x in models]
+            if model is None:
+                self.last_flush = time.perf_counter()
+
+        for model, rows in buffers:
+            if not rows:
+                continue
+
+            # Chunk the rows to stay under SQLite's variable limit
+            chunk_size = 999 // len(rows[0])
+            try:
+                with model._meta.database.atomic():  # type: ignore
+                    for chunk in pw.chunked(rows, chunk_size):
+                        model.insert_many(chunk).execute()
+            except Exception:
+                logger.exception(
+                    f"Error writing {len(rows)} buffered '{model.__name__}' row(s)."
+                )
+
+
+bulk_writer = BulkWriter()
+
 
 def get_drives() -> list[str]:
     """
     Returns a list of drives available in this device.
     """
 
+    # A single call that returns a bitmask of the present drives, no I/O
+    if platform.system() == "Windows":
+        mask = ctypes.windll.kernel32.GetLogicalDrives()  # type: ignore
+        return [
+            f"{drive}:\\"
+            for i, drive in enumerate(string.ascii_uppercase)
+            if mask & (1 << i)
+        ]
+
     drives = []
     for drive in string.ascii_uppercase:
         if os.path.exists(drive + ":\\"):
@@ -31,11 +143,17 @@ def log_error(
     metadata: Optional[dict] = None,
 ) -> Error:
     """
-    Log an error into the database.
+    Log an error into the database. The error is written through `bulk_writer`.
     """
 
-    return Error.create(
-        type=type, title=title, message=message, traceback=traceback, metadata=metadata
+    return bulk_writer.add(
+        Error(
+            type=type,
+            title=title,
+            message=message,
+            traceback=traceback,
+            metadata=metadata,
+        )
     )
 
 
@@ -44,15 +162,15 @@ def log_time_metric(
     tt: float,
     title: Optional[str] = None,
     message: Optional[str] = None,
-) -> None:
+) -> TimeMetric:
     """
-    Logs a time metric into the database.
+    Logs a time metric into the database. The metric is written through `bulk_writer`.
     """
 
-    return TimeMetric.create(type=type, tt=tt, title=title, message=message)
+    return bulk_writer.add(TimeMetric(type=type, tt=tt, title=title, message=message))
 
 
-def get_file_id(path: str) -> str:
+def get_file_id(path: str, stat: Optional[os.stat_result] = None) -> str:
     """
     Get the ID of a file. Derived from `st_dev` and `st_ino`.
 
@@ -60,16 +178,40 @@ def get_file_id(path: str) -> str:
     ----------
     `path` : str
         The path to the file.
+    `stat` : Optional[os.stat_result]
+        The result of `os.stat` on the file, if already known. Saves a stat call.
 
     Returns
     -------
     `str`
     """
 
-    file_stat = os.stat(path)
+    file_stat = stat or os.stat(path)
     return f"{file_stat.st_dev}-{file_stat.st_ino}"
 
 
+def stat_dir_entry(entry: os.DirEntry) -> os.stat_result:
+    """
+    Stat a directory entry returned by `os.scandir`. The entry's own (cached) stat is
+    used when possible, but on Windows it has no `st_dev` or `st_ino` so the file is
+    stat'ed with `os.stat`.
+
+    Parameters
+    ----------
+    `entry` : os.DirEntry
+        The directory entry.
+
+    Returns
+    -------
+    `os.stat_result`
+    """
+
+    if os.name == "nt":
+        return os.stat(entry.path)
+
+    return entry.stat()
+
+
 def get_object_type_from_file(path: str) -> Optional[ObjectType]:
     """
     Parameters
@@ -82,17 +224,85 @@ def get_object_type_from_file(path: str) -> Optional[ObjectType]:
     `Optional[ObjectType]`
     """
 
-    _, ext = os.path.splitext(path)
-    ext = ext.lower()
+    return _EXT_TO_TYPE.get(os.path.splitext(path)[1].lower())
+
+
+def _fast_image_size(path: str) -> Optional[tuple[int, int]]:
+    """
+    Read the size of a JPEG, PNG, GIF or WebP image from its header without decoding
+    it.
 
-    for type in config.types:
-        if ext in type["file_extensions"]:
-            return type["type"]
+    Parameters
+    ----------
+    `path` : str
+        The path to the image file.
+
+    Returns
+    -------
+    `Optional[tuple[int, int]]` :
+        The resolution in (w, h) or None if the format isn't recognized or the header
+        can't be parsed.
+    """
+
+    try:
+        with open(path, "rb", buffering=0) as f:
+            head = f.read(32)
+
+            # PNG, the IHDR chunk is always first
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+
+            # GIF, the logical screen descriptor follows the signature
+            if head[:6] in (b"GIF87a", b"GIF89a"):
+                return struct.unpack("<HH", head[6:10])
+
+            # WebP
+            if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                chunk = head[12:16]
+                if chunk == b"VP8X":
+                    width = int.from_bytes(head[24:27], "little") + 1
+                    height = int.from_bytes(head[27:30], "little") + 1
+                    return width, height
+                if chunk == b"VP8 ":
+                    width, height = struct.unpack("<HH", head[26:30])
+                    return width & 0x3FFF, height & 0x3FFF
+                if chunk == b"VP8L":
+                    bits = int.from_bytes(head[21:25], "little")
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+                return
+
+            # JPEG, walk the segments until a start of frame marker
+            if head[:2] == b"\xff\xd8":
+                f.seek(2)
+                while True:
+                    byte = f.read(1)
+                    if byte != b"\xff":
+                        return
+
+                    marker = f.read(1)
+                    while marker == b"\xff":
+                        marker = f.read(1)
+                    if not marker:
+                        return
+
+                    marker = marker[0]
+                    if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                        continue
+
+                    (length,) = struct.unpack(">H", f.read(2))
+                    if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                        height, width = struct.unpack(">xHH", f.read(5))
+                        return width, height
+
+                    f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return
 
 
 def get_image_resolution(path: str) -> Optional[tuple[int, int]]:
     """
-    Get the resolution of an image.
+    Get the resolution of an image. Common formats are read from the file header,
+    other formats are opened with PIL.
 
     Parameters
     ----------
@@ -103,8 +313,25 @@ def get_image_resolution(path: str) -> Optional[tuple[int, int]]:
     -------
     `Optional[tuple[int, int]]` :
         The resolution in (w, h) or None if parsing the image file fails.
+
+    Raises
+    ------
+    `Image.DecompressionBombError` :
+        If the image is larger than PIL allows, same as `Image.open`.
     """
 
+    resolution = _fast_image_size(path)
+    if resolution is not None:
+        width, height = resolution
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        if max_pixels and width * height > 2 * max_pixels:
+            raise Image.DecompressionBombError(
+                f"Image size ({width * height} pixels) exceeds the decompression "
+                "bomb limit."
+            )
+
+        return width, height
+
     try:
         with Image.open(path, "r") as image:
             image: Image.Image
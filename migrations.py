@@ -1,13 +1,92 @@
+import uuid
+
 import peewee as pw
 from playhouse.migrate import SqliteMigrator, migrate
 
 from database import db
 
 
+def add_column_if_missing(
+    migrator: SqliteMigrator, table: str, name: str, field: pw.Field
+) -> None:
+    """
+    Add a column to a table unless it already exists, so the migrations can be run
+    more than once.
+    """
+
+    if name in {x.name for x in db.get_columns(table)}:
+        return
+
+    migrate(migrator.add_column(table, name, field))
+
+
+def convert_uuids_to_bytes() -> None:
+    """
+    Convert the IDs stored by `UUIDField` as 32 character hex strings to 16 byte
+    blobs, as used by `BinaryUUIDField`. Rows that are already converted are left
+    untouched. Foreign keys must be disabled, as parent and child IDs are converted
+    one table at a time.
+    """
+
+    columns = {
+        "object": ["id"],
+        "objectdefinition": ["id", "object_id"],
+        "query": ["id"],
+        "queryresult": ["query_id", "object_id"],
+        "error": ["id"],
+        "timemetric": ["id"],
+    }
+
+    db.register_function(lambda x: uuid.UUID(x).bytes, "uuid_to_bytes", 1)
+
+    with db.atomic():
+        tables = db.get_tables()
+        for table, names in columns.items():
+            if table not in tables:
+                continue
+
+            for name in names:
+                db.execute_sql(
+                    f'UPDATE "{table}" SET "{name}" = uuid_to_bytes("{name}") '
+                    f"WHERE typeof(\"{name}\") = 'text'"
+                )
+
+
+def move_object_metadata_to_columns() -> None:
+    """
+    Move the file size and resolution of existing objects from their `metadata` into
+    the `file_size`, `width` and `height` columns. The old resolution also held a
+    `total` which is dropped, see `Object.pixel_count` instead.
+    """
+
+    db.execute_sql(
+        'UPDATE "object" SET '
+        "file_size = json_extract(metadata, '$.file_size'), "
+        "width = json_extract(metadata, '$.resolution.width'), "
+        "height = json_extract(metadata, '$.resolution.height'), "
+        "metadata = json_remove(metadata, '$.file_size', '$.resolution') "
+        "WHERE json_type(metadata, '$.file_size') IS NOT NULL"
+    )
+
+
 def perform_migrations() -> None:
     migrator = SqliteMigrator(db)
 
-    migrate(migrator.add_column("query", "returned_results", pw.IntegerField()))
+    # Adding a not null column rebuilds the table, which fails on the rows that
+    # reference it while foreign keys are enforced
+    db.pragma("foreign_keys", 0)
+    try:
+        convert_uuids_to_bytes()
+
+        add_column_if_missing(
+            migrator, "query", "returned_results", pw.IntegerField(default=0)
+        )
+
+        for name in ("file_size", "width", "height"):
+            add_column_if_missing(migrator, "object", name, pw.IntegerField(null=True))
+        move_object_metadata_to_columns()
+    finally:
+        db.pragma("foreign_keys", 1)
 
 
 if __name__ == "__main__":
@@ -12,7 +12,7 @@ class Error(BaseModel):
     through `utils.log_error`.
     """
 
-    id = pw.UUIDField(primary_key=True, unique=True, default=uuid.uuid4)
+    id = pw.BinaryUUIDField(primary_key=True, unique=True, default=uuid.uuid4)
     created_at = pw.DateTimeField(default=dt.datetime.now)
 
     type = pw.TextField(choices=error_log_types)
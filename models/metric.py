@@ -17,7 +17,7 @@ class TimeMetric(BaseModel):
     Logs time related performance. Useful for things like timing functions, operations, etc.
     """
 
-    id = pw.UUIDField(default=uuid.uuid4, primary_key=True)
+    id = pw.BinaryUUIDField(default=uuid.uuid4, primary_key=True)
     type = pw.TextField(choices=time_metric_types)
 
     tt = pw.FloatField()
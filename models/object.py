@@ -7,12 +7,13 @@ from database import BaseModel, JSONField, db
 from library import utils
 from library.types import definition_types, ignored_file_types, object_types
 from peewee import (
+    BinaryUUIDField,
     BooleanField,
     DateTimeField,
     FloatField,
     ForeignKeyField,
+    IntegerField,
     TextField,
-    UUIDField,
 )
 
 
@@ -32,14 +33,17 @@ class Object(BaseModel):
     A object is a file that can be queried with windows image explorer.
     """
 
-    id = UUIDField(primary_key=True, unique=True, default=uuid.uuid4)
+    id = BinaryUUIDField(primary_key=True, unique=True, default=uuid.uuid4)
     created_at = DateTimeField(default=dt.datetime.now)
     type = TextField(choices=object_types)
 
     path = TextField()
     name = TextField()
-    file_id = TextField(index=True, unique=True)
+    file_id = TextField(unique=True)
     file_creation_date = DateTimeField()
+    file_size = IntegerField(null=True)
+    width = IntegerField(null=True)
+    height = IntegerField(null=True)
     metadata = JSONField(null=True)
 
     processed = BooleanField(default=False)
@@ -49,9 +53,25 @@ class Object(BaseModel):
     error = BooleanField(default=False)
     error_traceback = TextField(null=True)
 
+    class Meta:
+        # Used by the tasks that look for unprocessed objects and objects without
+        # embeddings
+        indexes = ((("processed", "generated_embeddings", "error"), False),)
+
     def __str__(self) -> str:
         return f"{self.name} ({self.id})"
 
+    @property
+    def pixel_count(self) -> Optional[int]:
+        """
+        The number of pixels of the object. None if the object has no resolution.
+        """
+
+        if self.width is None or self.height is None:
+            return None
+
+        return self.width * self.height  # type: ignore
+
     def to_json(self) -> dict:
         return {
             "id": str(self.id),
@@ -61,6 +81,9 @@ class Object(BaseModel):
             "name": self.name,
             "file_id": self.file_id,
             "file_creation_date": self.file_creation_date,
+            "file_size": self.file_size,
+            "width": self.width,
+            "height": self.height,
             "metadata": self.metadata,
             "processed": self.processed,
             "last_processed_time": self.last_processed_time,
@@ -70,7 +93,9 @@ class Object(BaseModel):
         }
 
     @classmethod
-    def from_path(cls, path: str) -> Optional["Object"]:
+    def from_path(
+        cls, path: str, stat: Optional[os.stat_result] = None
+    ) -> Optional["Object"]:
         """
         Create a object from a file path.
 
@@ -78,6 +103,8 @@ class Object(BaseModel):
         ----------
         `path` : str
             The path to the file.
+        `stat` : Optional[os.stat_result]
+            The result of `os.stat` on the file, if already known.
 
         Returns
         -------
@@ -85,7 +112,9 @@ class Object(BaseModel):
             The created object. None if the provided file path can't be a valid object.
         """
 
-        metadata: dict = {"file_size": os.path.getsize(path)}
+        stat = stat or os.stat(path)
+
+        width = height = None
         type = utils.get_object_type_from_file(path)
         if type == "image":
             resolution = utils.get_image_resolution(path)
@@ -98,19 +127,17 @@ class Object(BaseModel):
                 )
                 return
 
-            metadata["resolution"] = {
-                "width": resolution[0],
-                "height": resolution[1],
-                "total": resolution[0] + resolution[1],
-            }
+            width, height = resolution
 
         return cls.create(
             type=type,
             path=path,
             name=os.path.basename(path),
-            file_id=utils.get_file_id(path),
-            file_creation_date=dt.datetime.fromtimestamp(os.path.getctime(path)),
-            metadata=metadata,
+            file_id=utils.get_file_id(path, stat),
+            file_creation_date=dt.datetime.fromtimestamp(stat.st_ctime),
+            file_size=stat.st_size,
+            width=width,
+            height=height,
         )
 
 
@@ -120,7 +147,7 @@ class ObjectDefinition(BaseModel):
     image-to-text descriptions, embeddings, etc.
     """
 
-    id = UUIDField(primary_key=True, default=uuid.uuid4)
+    id = BinaryUUIDField(primary_key=True, default=uuid.uuid4)
     created_at = DateTimeField(default=dt.datetime.now)
     type = TextField(choices=definition_types)
 
@@ -12,7 +12,7 @@ class Query(BaseModel):
     A user's query. Used for the search history as well as caching.
     """
 
-    id = pw.UUIDField(primary_key=True, default=uuid.uuid4)
+    id = pw.BinaryUUIDField(primary_key=True, default=uuid.uuid4)
     created_at = pw.DateTimeField(default=dt.datetime.now)
 
     # Parameters
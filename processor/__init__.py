@@ -4,10 +4,14 @@ import os
 from abc import ABC, abstractmethod
 from typing import Optional
 
+import orjson
 from library.exceptions import *
 from library.types import ObjectType
 from models.object import Object, ObjectDefinition
 
+# The directory of the processors and their `.json` config files
+_PROCESSOR_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
 @dataclasses.dataclass
 class ProcessorConfig:
@@ -18,6 +22,7 @@ class ProcessorConfig:
 
     model: str
     gpu: bool = False
+    half_precision: bool = False
     enabled: bool = True
 
 
@@ -28,6 +33,21 @@ class ProcessorABC(ABC):
         Process the object and create a definition for the object.
         """
 
+    def process_batch(self, objects: list[Object]) -> list[ObjectDefinition]:
+        """
+        Process multiple objects and create a definition for each object, in the same
+        order. Processors that can run on a whole batch at once should override this.
+        """
+
+        return [self.process(object) for object in objects]
+
+    def prefetch(self, objects: list[Object]) -> None:
+        """
+        Start loading the objects that will be passed to `process_batch` next.
+        Processors that read their input from disk can override this so loading
+        overlaps with processing the current batch.
+        """
+
 
 class BaseProcessor(ProcessorABC):
 
@@ -61,15 +81,20 @@ class BaseProcessor(ProcessorABC):
         self.title = title
         self.metadata = description
 
+        self._config_path = os.path.join(_PROCESSOR_DIR, f"{self.id}.json")
+        self._config_cache: Optional[ProcessorConfig] = None
+
     def get_config(self) -> ProcessorConfig:
         """
-        Return the config file for this processor
+        Return the config file for this processor. The config is only read once and
+        cached until it is changed with `set_config`.
         """
 
-        with open(
-            os.path.join(os.getcwd(), "processor", f"{self.id}.json"), encoding="utf-8"
-        ) as f:
-            return ProcessorConfig(**json.load(f))
+        if self._config_cache is None:
+            with open(self._config_path, "rb") as f:
+                self._config_cache = ProcessorConfig(**orjson.loads(f.read()))
+
+        return self._config_cache
 
     def set_config(self, config: ProcessorConfig) -> ProcessorConfig:
         """
@@ -80,11 +105,11 @@ class BaseProcessor(ProcessorABC):
 
         data = dataclasses.asdict(config)
 
-        with open(
-            os.path.join(os.getcwd(), "processor", f"{self.id}.json"), encoding="utf-8"
-        ) as f:
+        with open(self._config_path, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2)
-            return config
+
+        self._config_cache = config
+        return config
 
     def verify_object(self, object: Object) -> None:
         """
@@ -1,6 +1,10 @@
+import io
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
+import torch
 import transformers
+from configura import config
 from library import utils
 from library.exceptions import *
 from loguru import logger
@@ -21,12 +25,48 @@ class ImageProcessor(BaseProcessor):
 
         self.config = self.get_config()
 
+        # Half precision is only used on the GPU, the CPU stays in fp32
+        self.dtype = torch.float32
+        if self.config.gpu and self.config.half_precision:
+            self.dtype = (
+                torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            )
+
+        # The weights are loaded straight in the target dtype, without first
+        # materializing a fp32 copy of the model
         self.processor = transformers.BlipProcessor.from_pretrained(self.config.model)
         self.model = transformers.BlipForConditionalGeneration.from_pretrained(
-            self.config.model
+            self.config.model, torch_dtype=self.dtype, low_cpu_mem_usage=True
         )
         if self.config.gpu:
             self.model = self.model.to("cuda")  # type: ignore
+        self.model.eval()
+
+        # Decoding images releases the GIL, so they are loaded in parallel
+        self.loader = ThreadPoolExecutor(
+            max_workers=config.main["processing_load_workers"],
+            thread_name_prefix="image-load",
+        )
+
+        # Images that are being loaded ahead of `process_batch`, by path
+        self.prefetched: dict[str, Future] = {}
+
+    def load_image(self, path: str) -> Image.Image:
+        """
+        Open an image as RGB. JPEGs are decoded at a reduced scale that is still at
+        least twice the model's input size, as the processor resizes them down anyway.
+        The file is read in a single unbuffered read and decoded from memory.
+        """
+
+        with open(path, "rb", buffering=0) as f:
+            data = f.read()
+
+        image = Image.open(io.BytesIO(data))
+
+        size = self.processor.image_processor.size  # type: ignore
+        image.draft("RGB", (size["width"] * 2, size["height"] * 2))
+
+        return image.convert("RGB")
 
     def process(self, object: Object) -> ObjectDefinition:
         """
@@ -34,23 +74,58 @@ class ImageProcessor(BaseProcessor):
         object.
         """
 
-        self.verify_object(object)
+        return self.process_batch([object])[0]
 
-        st = time.perf_counter()
+    def prefetch(self, objects: list[Object]) -> None:
+        """
+        Start loading the images of the provided objects on the loader threads, so
+        they are ready when the objects are passed to `process_batch`.
+        """
 
-        img = Image.open(str(object.path)).convert("RGB")
+        for object in objects:
+            path = str(object.path)
+            if path not in self.prefetched:
+                self.prefetched[path] = self.loader.submit(self.load_image, path)
 
-        # Generate the caption
-        inputs = self.processor(img, return_tensors="pt")
-        if self.config.gpu:
-            inputs = inputs.to("cuda")
-        output = self.model.generate(**inputs)  # type: ignore
+    def process_batch(self, objects: list[Object]) -> list[ObjectDefinition]:
+        """
+        Generate a object definition that contains a description of every provided
+        image object. Prefetched images are reused, the others are loaded in parallel.
+        All images are captioned with a single `generate` call.
+        """
+
+        for object in objects:
+            self.verify_object(object)
+
+        futures = []
+        for object in objects:
+            path = str(object.path)
+            future = self.prefetched.pop(path, None)
+            futures.append(future or self.loader.submit(self.load_image, path))
 
-        caption = self.processor.decode(output[0], skip_special_tokens=True)
+        images = [x.result() for x in futures]
+
+        st = time.perf_counter()
+
+        # Generate the captions
+        inputs = self.processor(images, return_tensors="pt")
+        if self.config.gpu:
+            inputs = inputs.to("cuda", self.dtype)
+        with torch.inference_mode():
+            # Greedy decoding, captions are short so beam search isn't worth the cost
+            output = self.model.generate(  # type: ignore
+                **inputs,
+                num_beams=1,
+                do_sample=False,
+                max_new_tokens=20,
+                use_cache=True,
+            )
+
+        captions = self.processor.batch_decode(output, skip_special_tokens=True)
 
         tt = time.perf_counter() - st
 
-        message = f"Generated image caption of '{caption}' for object '{object}'."
+        message = f"Generated {len(captions)} image caption(s) in {round(tt, 2)}s."
         logger.info(message)
 
         utils.log_time_metric(
@@ -60,13 +135,25 @@ class ImageProcessor(BaseProcessor):
             message=message,
         )
 
-        return ObjectDefinition.create(
-            type="image-description",
-            content=caption,
-            tt=tt,
-            model=self.config.model,
-            object=object,
-        )
+        definitions = []
+        for object, caption in zip(objects, captions):
+            logger.debug(
+                f"Generated image caption of '{caption}' for object '{object}'."
+            )
+            definitions.append(
+                ObjectDefinition(
+                    type="image-description",
+                    content=caption,
+                    tt=tt / len(objects),
+                    model=self.config.model,
+                    object=object,
+                )
+            )
+
+        # Save all the definitions with a single insert
+        ObjectDefinition.bulk_create(definitions)
+
+        return definitions
 
 
 def setup():
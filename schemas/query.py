@@ -22,4 +22,4 @@ class GetQueriesSchema(PagingSchema):
 
 
 class QueryResultsSchema(PagingSchema):
-    id = fields.Str()
+    id = fields.UUID()